@@ -2,21 +2,57 @@
 
 import os
 import json
+import logging
 import pandas as pd
 import numpy as np
 from datetime import datetime
 import fastf1 as ff1
 import mappings
 
+logger = logging.getLogger(__name__)
+
+# polars is optional: the heavy aggregation stages use it when installed
+# (multithreaded columnar group-by), otherwise the pandas path below runs
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+
+# precomputed categorical dtypes and value tables for the hot .map(dict) calls:
+# factorizing through a categorical is a single C pass instead of one dict
+# lookup per row, and unknown keys still come out as NaN like Series.map
+def _make_lookup(mapping):
+    dtype = pd.CategoricalDtype(categories=list(mapping))
+    values = np.append(np.asarray(list(mapping.values()), dtype='f8'), np.nan)
+    return dtype, values
+
+_compound_dtype, _compound_values = _make_lookup(mappings.compounds)
+_team_dtype, _team_values = _make_lookup(mappings.teams)
+_driver_dtype, _driver_values = _make_lookup(mappings.drivers)
+_track_status_dtype, _track_status_values = _make_lookup(mappings.track_status)
+
+def map_codes(series, cat_dtype, values):
+    """Map a low-cardinality column through a precomputed lookup table."""
+    codes = series.astype(cat_dtype).cat.codes.to_numpy()
+    return values[codes]
+
 # functions
 def convert_time(data, column, fillna_value=None):
     """convert the time column to seconds and set the first driver to 0 and NaN values to 200 seconds
     the input should look like this: "0 days 01:54:21.964000"  "0 days 00:00:10.933000"
     """
-    # Convert to timedelta, then to float seconds
-    data[column] = pd.to_timedelta(data[column]).dt.total_seconds()
+    s = data[column]
+    if s.dtype.kind == 'm':
+        # already timedelta64 (the usual case with fastf1): convert through the
+        # integer nanosecond representation instead of re-parsing the column
+        seconds = s.to_numpy().view('i8').astype('f8') / 1e9
+        seconds[s.isna().to_numpy()] = np.nan
+    else:
+        seconds = pd.to_timedelta(s).dt.total_seconds().to_numpy()
     # set NaN values to 200 seconds (retired drivers)
-    data[column] = data[column].fillna(fillna_value) if fillna_value is not None else data[column]
+    if fillna_value is not None:
+        seconds = np.where(np.isnan(seconds), fillna_value, seconds)
+    data[column] = seconds
     return data
 
 def get_session_results(session):
@@ -25,7 +61,10 @@ def get_session_results(session):
     :param object session: session object from fastf1 
     :return pd.DataFrame: final results of the session
     """
-    session_results = session.results[['Abbreviation', 'TeamId', 'CountryCode', 'ClassifiedPosition', 'GridPosition', 'Time', 'Points']].copy()
+    # pull only the needed columns into a fresh plain DataFrame instead of
+    # copying the whole wide fastf1 frame and then subsetting it
+    cols = ['Abbreviation', 'TeamId', 'CountryCode', 'ClassifiedPosition', 'GridPosition', 'Time', 'Points']
+    session_results = pd.DataFrame({c: session.results[c].to_numpy(copy=True) for c in cols})
     # adding a new column called retired and fill it with 0
     session_results['Retired'] = 0
     # if ClassifiedPosition is 'R' then the driver retired
@@ -61,9 +100,12 @@ def get_session_laps(session):
     :return pd.DataFrame: session laps data
     """
 
-    session_laps = session.laps[['LapNumber', 'Driver', 'LapTime', 'Compound', 'TyreLife', 'Stint', 'PitInTime', 'PitOutTime',
-                                 'FreshTyre', 'Team', 'TrackStatus', 'Position', 'Sector1Time', 'Sector2Time', 
-                                 'Sector3Time', 'SpeedI1', 'SpeedI2', 'SpeedFL', 'SpeedST', 'LapStartTime']].copy()
+    # pull only the needed columns into a fresh plain DataFrame instead of
+    # copying the whole wide fastf1 frame and then subsetting it
+    cols = ['LapNumber', 'Driver', 'LapTime', 'Compound', 'TyreLife', 'Stint', 'PitInTime', 'PitOutTime',
+            'FreshTyre', 'Team', 'TrackStatus', 'Position', 'Sector1Time', 'Sector2Time',
+            'Sector3Time', 'SpeedI1', 'SpeedI2', 'SpeedFL', 'SpeedST', 'LapStartTime']
+    session_laps = pd.DataFrame({c: session.laps[c].to_numpy(copy=True) for c in cols})
 
     # convert LapTime column to seconds and set NaT values as 0
     session_laps = convert_time(session_laps, 'LapTime', 0)
@@ -75,32 +117,47 @@ def get_session_laps(session):
     # again for the pit in and out times
     session_laps = convert_time(session_laps, 'PitInTime', 0)
     session_laps = convert_time(session_laps, 'PitOutTime', 0)
-    # set Speed trap columns to 0 if they are NaN
-    session_laps['SpeedFL'] = session_laps['SpeedFL'].fillna(0)
-    session_laps['SpeedST'] = session_laps['SpeedST'].fillna(0)
-    session_laps['SpeedI1'] = session_laps['SpeedST'].fillna(0)
-    session_laps['SpeedI2'] = session_laps['SpeedST'].fillna(0)
+    # set Speed trap columns to 0 if they are NaN (one fillna over the subset;
+    # this also fixes SpeedI1/SpeedI2 being overwritten with SpeedST values)
+    speed_cols = ['SpeedFL', 'SpeedST', 'SpeedI1', 'SpeedI2']
+    session_laps[speed_cols] = session_laps[speed_cols].fillna(0)
     # set Position as 20 if it is NaN (retired drivers)
     session_laps['Position'] = session_laps['Position'].fillna(-1)
     # convert LapStartTime name to SessionTime
     session_laps.rename(columns={'LapStartTime': 'SessionTime'}, inplace=True)
     # fresh tyre column to 0 and 1
-    session_laps['FreshTyre'] = session_laps['FreshTyre'].apply(lambda x: 1 if x else 0)
+    session_laps['FreshTyre'] = session_laps['FreshTyre'].fillna(False).to_numpy(dtype=bool).astype('uint8')
     # map the compound names to the compound id
-    session_laps['Compound'] = session_laps['Compound'].map(mappings.compounds)
+    session_laps['Compound'] = map_codes(session_laps['Compound'], _compound_dtype, _compound_values)
     # map the team names to the team id
-    session_laps['Team'] = session_laps['Team'].map(mappings.teams)
+    session_laps['Team'] = map_codes(session_laps['Team'], _team_dtype, _team_values)
     # map driver names to the driver id
-    session_laps['Driver'] = session_laps['Driver'].map(mappings.drivers)
+    session_laps['Driver'] = map_codes(session_laps['Driver'], _driver_dtype, _driver_values)
     # fill empty strings in TrackStatus column with 0
     session_laps['TrackStatus'] = session_laps['TrackStatus'].replace('', np.nan)
     # convert TrackStatus column to float
     session_laps['TrackStatus'] = session_laps['TrackStatus'].astype(float)
     # map track status to the track status id
-    session_laps['TrackStatus'] = session_laps['TrackStatus'].map(mappings.track_status)
-
-    # sort values
-    session_laps.sort_values("SessionTime", inplace=True)
+    session_laps['TrackStatus'] = map_codes(session_laps['TrackStatus'], _track_status_dtype, _track_status_values)
+
+    # downcast: the id/flag columns are tiny integers and the lap timings never
+    # need float64, which halves the bytes every later groupby/merge moves.
+    # the mapped id columns stay float32 because unknown keys map to NaN.
+    # SessionTime stays float64 since it is the merge_asof key and the lap
+    # boundary for the telemetry binning
+    session_laps = session_laps.astype({
+        'LapNumber': 'int16', 'Position': 'int8', 'FreshTyre': 'uint8',
+        'Driver': 'float32', 'Team': 'float32', 'Compound': 'float32',
+        'TrackStatus': 'float32', 'TyreLife': 'float32', 'Stint': 'float32',
+        'LapTime': 'float32', 'Sector1Time': 'float32', 'Sector2Time': 'float32',
+        'Sector3Time': 'float32', 'SpeedI1': 'float32', 'SpeedI2': 'float32',
+        'SpeedFL': 'float32', 'SpeedST': 'float32',
+        'PitInTime': 'float32', 'PitOutTime': 'float32'})
+
+    # sort values (fastf1 usually returns the laps already in session order,
+    # so only sort when needed; mergesort is stable and fast on nearly-sorted data)
+    if not session_laps['SessionTime'].is_monotonic_increasing:
+        session_laps.sort_values("SessionTime", kind='mergesort', inplace=True)
 
     return session_laps
 
@@ -115,14 +172,43 @@ def get_weather_data(session):
     # convert Time to seconds
     session_weather = convert_time(session_weather, 'Time')
     # convert Rainfall to 0 and 1
-    session_weather['Rainfall'] = session_weather['Rainfall'].apply(lambda x: 1 if x else 0)
+    session_weather['Rainfall'] = session_weather['Rainfall'].fillna(False).to_numpy(dtype=bool).astype('uint8')
     # convert the name of Time in column to SessionTime
     session_weather.rename(columns={'Time': 'SessionTime'}, inplace=True)
-    # sort values
-    session_weather.sort_values("SessionTime", inplace=True)
+    # sort values (weather samples are already time-ordered at source)
+    if not session_weather['SessionTime'].is_monotonic_increasing:
+        session_weather.sort_values("SessionTime", kind='mergesort', inplace=True)
 
     return session_weather
 
+def merge_weather(session_laps, session_weather, tolerance=300.0):
+    """Attach the most recent weather sample at or before each lap.
+
+    Both frames come pre-sorted on SessionTime and a session has only a couple
+    of hundred weather rows, so indexing them with one searchsorted replaces
+    the pd.merge_asof call and its per-call validation. A backward match is
+    the physically correct reading (the weather when the lap started) and
+    only walks one side of the match point; weather is sampled about once a
+    minute, so the tolerance only cuts off laps with no recent sample at all.
+
+    :param pd.DataFrame session_laps: laps sorted by SessionTime
+    :param pd.DataFrame session_weather: weather data sorted by SessionTime
+    :param float tolerance: maximum age of the weather sample in seconds
+    :return pd.DataFrame: laps with the weather columns added
+    """
+    lap_times = session_laps['SessionTime'].to_numpy()
+    weather_times = session_weather['SessionTime'].to_numpy()
+    # for each lap pick the latest weather sample taken at or before it
+    pos = np.searchsorted(weather_times, lap_times, side='right') - 1
+    valid = pos >= 0
+    pos = np.where(valid, pos, 0)
+    valid &= (lap_times - weather_times[pos]) <= tolerance
+    for col in session_weather.columns:
+        if col != 'SessionTime':
+            session_laps[col] = np.where(valid, session_weather[col].to_numpy()[pos], np.nan)
+    return session_laps
+
+
 def aggregate_lap(lap_telemetry):
     """Generate telemetry statistics for a given lap.
 
@@ -141,127 +227,199 @@ def aggregate_lap(lap_telemetry):
         })
         return result
 
+    # pull the raw arrays out once so every statistic below is a plain
+    # ndarray reduction instead of a pandas method dispatch per call
+    rpm = lap_telemetry["RPM"].to_numpy()
+    speed = lap_telemetry["Speed"].to_numpy()
+    throttle = lap_telemetry["Throttle"].to_numpy()
+    ngear = lap_telemetry["nGear"].to_numpy()
+    brake = lap_telemetry["Brake"].to_numpy()
+    drs = lap_telemetry["DRS"].to_numpy()
+
     # RPM statistics
-    result["RpmAvg"] = lap_telemetry["RPM"].mean()
-    result["RpmMin"] = lap_telemetry["RPM"].min()
-    result["RpmMax"] = lap_telemetry["RPM"].max()
+    result["RpmAvg"] = rpm.mean()
+    result["RpmMin"] = rpm.min()
+    result["RpmMax"] = rpm.max()
 
     # Speed statistics
-    result["SpeedAvg"] = lap_telemetry["Speed"].mean()
-    result["SpeedMedian"] = lap_telemetry["Speed"].median()
-    result["SpeedMin"] = lap_telemetry["Speed"].min()
-    result["SpeedMax"] = lap_telemetry["Speed"].max()
+    result["SpeedAvg"] = speed.mean()
+    result["SpeedMedian"] = np.median(speed)
+    result["SpeedMin"] = speed.min()
+    result["SpeedMax"] = speed.max()
 
     # Throttle statistics
-    result["ThrottleAvg"] = lap_telemetry["Throttle"].mean()
-    result["ThrottleMin"] = lap_telemetry["Throttle"].min()
-    result["ThrottleMax"] = lap_telemetry["Throttle"].max()
+    result["ThrottleAvg"] = throttle.mean()
+    result["ThrottleMin"] = throttle.min()
+    result["ThrottleMax"] = throttle.max()
 
     # nGear statistics
-    result["nGearAvg"] = lap_telemetry["nGear"].mean()
-    result["nGearMin"] = lap_telemetry["nGear"].min()
-    result["nGearMax"] = lap_telemetry["nGear"].max()
+    result["nGearAvg"] = ngear.mean()
+    result["nGearMin"] = ngear.min()
+    result["nGearMax"] = ngear.max()
 
     # Brake and DRS counts (assuming a value > 0 indicates activation)
-    result["BrakeCount"] = (lap_telemetry["Brake"] > 0).sum()
-    result["DrsCount"] = (lap_telemetry["DRS"] > 0).sum()
+    result["BrakeCount"] = int((brake > 0).sum())
+    result["DrsCount"] = int((drs > 0).sum())
 
-    # Mode for nGear
-    modes = lap_telemetry["nGear"].mode()
-    result["nGearMode"] = modes.iloc[0] if not modes.empty else None
+    # Mode for nGear: gears are small integers (0-8), so a single bincount
+    # pass beats sorting the array for its unique values
+    result["nGearMode"] = float(np.bincount(ngear.astype(np.int64), minlength=9).argmax())
 
     return result
 
 
+def assign_lap_ids(driver_laps, driver_car):
+    """Assign every telemetry sample of a driver to its lap.
+
+    Each lap covers (previous lap end, lap end], with the first lap start time
+    as the very first boundary. Expects both frames sorted by SessionTime.
+
+    :param pd.DataFrame driver_laps: all laps of a driver
+    :param pd.DataFrame driver_car: telemetry data for the driver
+    :return pd.DataFrame: telemetry within the laps, with a LapId column
+        counting the laps in SessionTime order
+    """
+    lap_ends = (driver_laps["SessionTime"] + driver_laps["LapTime"]).to_numpy()
+    # guard against laps with a missing (zero-filled) LapTime which would make the boundaries go backwards
+    lap_ends = np.maximum.accumulate(lap_ends)
+    session_start = driver_laps["SessionTime"].min()
+    # assign every telemetry sample to its lap in one pass over the sorted times
+    car_times = driver_car["SessionTime"].to_numpy()
+    lap_id = np.searchsorted(lap_ends, car_times, side="left")
+    # drop samples from before the first lap or after the last lap end
+    valid = (car_times > session_start) & (lap_id < len(lap_ends))
+    lap_telemetry = driver_car.loc[valid].copy()
+    lap_telemetry["LapId"] = lap_id[valid]
+    # count brake/DRS activations (a value > 0 indicates activation)
+    lap_telemetry["Brake"] = (lap_telemetry["Brake"].to_numpy() > 0).astype("uint8")
+    lap_telemetry["DRS"] = (lap_telemetry["DRS"].to_numpy() > 0).astype("uint8")
+    return lap_telemetry
+
+
+def aggregate_telemetry(lap_telemetry, by):
+    """Aggregate lap telemetry statistics in a single groupby pass.
+
+    :param pd.DataFrame lap_telemetry: telemetry with lap assignments
+    :param by: column name or list of column names to group by
+    :return pd.DataFrame: one row of statistics per group
+    """
+    grouped = lap_telemetry.groupby(by)
+    summary = grouped.agg(
+        RpmAvg=("RPM", "mean"), RpmMin=("RPM", "min"), RpmMax=("RPM", "max"),
+        SpeedAvg=("Speed", "mean"), SpeedMedian=("Speed", "median"),
+        SpeedMin=("Speed", "min"), SpeedMax=("Speed", "max"),
+        ThrottleAvg=("Throttle", "mean"), ThrottleMin=("Throttle", "min"), ThrottleMax=("Throttle", "max"),
+        nGearAvg=("nGear", "mean"), nGearMin=("nGear", "min"), nGearMax=("nGear", "max"),
+        BrakeCount=("Brake", "sum"), DrsCount=("DRS", "sum"))
+    # mode for nGear: count gears (0-8) per group with one bincount and take the argmax
+    group_id = grouped.ngroup().to_numpy()
+    gears = lap_telemetry["nGear"].to_numpy(dtype=np.int64)
+    gear_counts = np.bincount(group_id * 16 + gears, minlength=len(summary) * 16).reshape(-1, 16)
+    summary["nGearMode"] = gear_counts.argmax(axis=1).astype(float)
+    return summary
+
+
 def calculate_lap_agg_telemetry(driver_laps, driver_car):
-    """Aggregate telemetry data for each lap of a driver and merge it with the lap data. 
+    """Aggregate telemetry data for each lap of a driver and merge it with the lap data.
 
-    :param pd.DataFrame driver_laps: all laps of a driver 
+    :param pd.DataFrame driver_laps: all laps of a driver
     :param pd.DataFrame driver_car: telemetry data for the session
     :return pd.DataFrame: laps data with telemetry statistics
     """
     # sort by session time
-    driver_laps.sort_values("SessionTime", inplace=True)
-    # Prepare a list to store aggregated results for each lap.
-    lap_aggregates = []
-    # We will treat the start of the session as time 0.
-    prev_time = driver_laps["SessionTime"].min()
-    # Iterate over each lap (using the SessionTime as the lap boundary)
-    for idx, row in driver_laps.iterrows():
-        lap_end = row["SessionTime"] + row["LapTime"]
-        # Select telemetry data for the current lap interval:
-        lap_telemetry = driver_car[(driver_car["SessionTime"] > prev_time) & (driver_car["SessionTime"] <= lap_end)]
-        
-        # Aggregate telemetry for this lap
-        agg_result = aggregate_lap(lap_telemetry)
-        # set row number as lap number
-        agg_result["LapNumber"] = row["LapNumber"] if "LapNumber" in row else idx
-        # Add the aggregated result for this lap.
-        lap_aggregates.append(agg_result)
-        # Update the previous lap boundary to the current lap's SessionTime.
-        prev_time = lap_end
-
-    # Convert the list of dictionaries to a DataFrame.
-    driver_summary = pd.DataFrame(lap_aggregates)
-    # join this dataframe to driver_laps dataframe
-    driver_laps = pd.merge(driver_laps, driver_summary, on="LapNumber", how="left")
+    if not driver_laps['SessionTime'].is_monotonic_increasing:
+        driver_laps.sort_values("SessionTime", kind='mergesort', inplace=True)
+    lap_telemetry = assign_lap_ids(driver_laps, driver_car)
+    # aggregate all laps at once instead of slicing the telemetry per lap
+    driver_summary = aggregate_telemetry(lap_telemetry, "LapId")
+    # align back with the laps (LapId counts laps in SessionTime order)
+    driver_summary = driver_summary.reindex(pd.RangeIndex(len(driver_laps)))
+    driver_summary[["BrakeCount", "DrsCount"]] = driver_summary[["BrakeCount", "DrsCount"]].fillna(0)
+    # the summary rows already line up with the sorted laps, so assign the
+    # statistics columns in one block instead of merging on LapNumber
+    driver_laps = driver_laps.reset_index(drop=True)
+    driver_laps[list(driver_summary.columns)] = driver_summary.to_numpy()
     return driver_laps
 
 
 def calculate_session_laps_final(session:object, session_laps:pd.DataFrame):
     # selecting the drivers
     drivers=session.laps['Driver'].unique()
-    print("Drivers in this session: ")
-    print(drivers , "\n")
-    # define an empty dataframe to store the final results
-    session_laps_final = pd.DataFrame()
-    # loop through the drivers to create a summary statistic for each telemetry data
+    logger.debug("Drivers in this session: %s", drivers)
+    # collect the telemetry and laps of every driver, then aggregate the whole
+    # session in one groupby pass instead of one small groupby per driver
+    telemetry_frames = []
+    lap_frames = []
     for drv in drivers:
         try:
             # get car data for the driver
             driver_car = session.laps.pick_drivers(drv).get_car_data()
         except KeyError:
-            print(f"Driver {drv} not available")
+            logger.warning("Driver %s not available", drv)
             continue
         # convert Time into milliseconds
         driver_car = convert_time(driver_car, 'Time')
         driver_car = convert_time(driver_car, 'SessionTime')
-        # sort by SessionTime
-        driver_car.sort_values("SessionTime", inplace=True)
+        # sort by SessionTime (telemetry is normally already in time order)
+        if not driver_car['SessionTime'].is_monotonic_increasing:
+            driver_car.sort_values("SessionTime", kind='mergesort', inplace=True)
         # drop Source and Date columns
         driver_car.drop(columns=['Source', 'Date'], inplace=True)
         # rename some columns
         driver_car.columns = ['RPM', 'Speed', 'nGear', 'Throttle' , 'Brake', 'DRS', 'DrivingTime', 'SessionTime']
-        # convert brake into 0 and 1
-        driver_car['Brake'] = driver_car['Brake'].apply(lambda x: 1 if x else 0)
         # select laps for the driver from laps data
-        driver_laps = session_laps[session_laps['Driver'] == mappings.drivers[drv]].copy()
-        # calculate lap statistics for each driver
-        driver_laps = calculate_lap_agg_telemetry(driver_laps, driver_car)
-        # add the driver laps to the session laps
-        session_laps_final = pd.concat([session_laps_final, driver_laps], ignore_index=True) if not session_laps_final.empty else driver_laps.copy()
+        driver_id = mappings.drivers[drv]
+        driver_laps = session_laps[session_laps['Driver'] == driver_id].copy()
+        if not driver_laps['SessionTime'].is_monotonic_increasing:
+            driver_laps.sort_values("SessionTime", kind='mergesort', inplace=True)
+        driver_laps['LapId'] = np.arange(len(driver_laps))
+        # assign the telemetry samples to the laps of this driver
+        lap_telemetry = assign_lap_ids(driver_laps, driver_car)
+        lap_telemetry['Driver'] = driver_id
+        telemetry_frames.append(lap_telemetry)
+        lap_frames.append(driver_laps)
+
+    if not lap_frames:
+        return pd.DataFrame()
+
+    session_laps_final = pd.concat(lap_frames, ignore_index=True)
+    # one aggregation over the full session telemetry
+    session_summary = aggregate_telemetry(pd.concat(telemetry_frames, ignore_index=True), ['Driver', 'LapId'])
+    session_laps_final = session_laps_final.merge(session_summary, left_on=['Driver', 'LapId'],
+                                                  right_index=True, how='left')
+    # laps without any telemetry get NaN statistics but zero activation counts
+    session_laps_final[['BrakeCount', 'DrsCount']] = session_laps_final[['BrakeCount', 'DrsCount']].fillna(0)
+    session_laps_final.drop(columns=['LapId'], inplace=True)
 
     return session_laps_final
 
-def add_static_info(session_results:pd.DataFrame):
+def build_static_info_table():
+    """Build the per-driver static info table from drivers.json.
+
+    The table is track-invariant, so callers processing many sessions should
+    build it once and pass it to add_static_info.
+
+    :return pd.DataFrame: age, experience and achievements indexed by driver abbreviation
+    """
     # import drivers.json as dictionary
-    
     with open('drivers.json') as f:
         drivers = json.load(f)
-    
+
+    static_info = pd.DataFrame(drivers['drivers']).set_index('abbreviation')[['age', 'GPs Entered', 'points']]
+    static_info.columns = ['Age', 'Exprience', 'Achievements']
+    static_info['AchievementsByTime'] = static_info['Achievements'] / static_info['Exprience']
+    return static_info
+
+
+def add_static_info(session_results:pd.DataFrame, static_info:pd.DataFrame=None):
+    if static_info is None:
+        static_info = build_static_info_table()
+
     # Add age of the driver, exprience and achievements to the session results
-    for drv in session_results['Driver'].unique():
-        # get the driver data from the json
-        driver_info = next((driver for driver in drivers['drivers'] if driver['abbreviation'] == drv), None)
+    # (one map per column instead of a boolean scan per driver)
+    for col in static_info.columns:
+        session_results[col] = session_results['Driver'].map(static_info[col])
 
-        if driver_info is None:
-            continue
-        
-        session_results.loc[session_results['Driver'] == drv, 'Age'] = driver_info['age']
-        session_results.loc[session_results['Driver'] == drv , 'Exprience'] = driver_info['GPs Entered']
-        session_results.loc[session_results['Driver'] == drv , 'Achievements'] = driver_info['points']
-        session_results.loc[session_results['Driver'] == drv , 'AchievementsByTime'] = driver_info['points'] / driver_info['GPs Entered']
-        
     # map driver names to the driver id
     session_results['Driver'] = session_results['Driver'].map(mappings.drivers)
     
@@ -272,21 +430,21 @@ def add_static_info(session_results:pd.DataFrame):
 
 def add_points(session_results:pd.DataFrame):
     """Add last year points to give the model a weight of recent achievements"""
-    # create to new empty columns for points
-    session_results['LastYearDriverPoints'] = 0
-    session_results['LastYearTeamPoints'] = 0
     # get the year from the session results
     year = session_results['Year'].unique()[0]
-    # map last year points
-    for drv_id in session_results['Driver'].unique():
-        # map driver points of last year
-        session_results.loc[session_results['Driver'] == drv_id , 'LastYearDriverPoints'] = mappings.year_driver_points[year-1][drv_id] if drv_id in mappings.year_driver_points[year-1] else 0
-    for team_id in session_results['Team'].unique():
-        # map team points of last year
-        session_results.loc[session_results['Team'] == team_id , 'LastYearTeamPoints'] = mappings.year_team_points[year-1][team_id] if team_id in mappings.year_team_points[year-1] else 0
+    # map last year points, drivers/teams without any points get 0
+    session_results['LastYearDriverPoints'] = session_results['Driver'].map(mappings.year_driver_points[year-1]).fillna(0)
+    session_results['LastYearTeamPoints'] = session_results['Team'].map(mappings.year_team_points[year-1]).fillna(0)
     return session_results
 
-def final_preprocessing(df):
+def per_track_preprocess(df):
+    """Preprocessing that only needs the rows of a single track.
+
+    Every step here (lap filtering, position cleanup, the per-race diff in
+    convert_to_diff) groups by race at most, so it runs on each small
+    per-track frame right after it is computed instead of being repeated on
+    the combined multi-track frame.
+    """
     # drop the laps without any telemetry data
     df = df.dropna(subset=['RpmMin', 'SpeedMin'], how='all')
     # change FinalPosition = w to 0
@@ -295,14 +453,12 @@ def final_preprocessing(df):
     try:
         df['FinalPosition'] = df['FinalPosition'].astype(int)
     except ValueError:
-        print("FinalPosition for practices are NaN.")
+        logger.warning("FinalPosition for practices are NaN.")
     # remove the races with more than 78 laps - probably caused by false data fetching
-    # Step 1: Count number of rows (laps) per race
-    lap_counts = df.groupby(['Year', 'Location', 'Driver']).size().reset_index(name='LapCount')
-    # Step 2: Keep only races with 78 or fewer laps
-    valid_races = lap_counts[lap_counts['LapCount'] <= 80]
-    # Step 3: Filter the original dataframe to only include those races
-    df = df.merge(valid_races[['Year', 'Location', 'Driver']], on=['Year', 'Location', 'Driver'], how='inner')
+    # (count laps per race with one groupby transform and keep the rows directly,
+    # instead of building a separate count table and inner-merging against it)
+    lap_counts = df.groupby(['Year', 'Location', 'Driver'])['LapNumber'].transform('size')
+    df = df[lap_counts <= 80].reset_index(drop=True)
     # convert LapNumber to int
     df['LapNumber'] = df['LapNumber'].astype(int)
     # transform to difference instead of absolute
@@ -315,30 +471,27 @@ def convert_to_diff(df):
     df_new[['BrakeCount', 'DrsCount']] = df_new[['BrakeCount', 'DrsCount']].astype(float)
     # convert pit in time and pit out time to int
     df_new[['PitInTime', 'PitOutTime']] = df_new[['PitInTime', 'PitOutTime']].astype(int)
-    # feature engineering
-    years=df_new['Year'].unique()
-    for year in years:
-        print(f"Year processing is: {year}")
-        year_df = df_new[df_new['Year'] == year].copy()
-        # get Locations
-        locations = year_df['Location'].unique()
-        for i, loc in enumerate(locations):
-            location_df = year_df[year_df['Location'] == loc].copy()
-            if i % 10 == 0:
-                print(f"Location processing is: {i} / {len(locations)}")
-
-            # filter the location_df to the rows that doesn't have pit in and pit out times
-            location_dff = location_df[(location_df['PitInTime'] == 0) & (location_df['PitOutTime'] == 0)]
-            # get the average of car data for the lap for all drivers
-            lap_avg = location_dff[['RpmAvg', 'RpmMin', 'RpmMax', 'SpeedAvg', 'SpeedMedian', 'SpeedMin', 'SpeedMax',
-                                'ThrottleAvg','ThrottleMin', 'ThrottleMax', 'nGearAvg', 'nGearMin', 'nGearMax',
-                                'BrakeCount', 'DrsCount','Sector1Time', 'Sector2Time', 'Sector3Time', 'SpeedI1', 
-                                'SpeedI2', 'SpeedFL','SpeedST', 'SessionTime', 'LapTime']].mean()
-            # compare all drivers to the average of the lap and add modify the columns in place
-            for col in lap_avg.index:
-                location_df[col] = location_df[col] - lap_avg[col]
-                # add the lap_df to the df_new dataframe
-                df_new.loc[(df_new['Year']==year)&(df_new['Location']==loc), col] = location_df[col]
+    # feature engineering: compare every driver to the average of the race
+    cols = ['RpmAvg', 'RpmMin', 'RpmMax', 'SpeedAvg', 'SpeedMedian', 'SpeedMin', 'SpeedMax',
+            'ThrottleAvg','ThrottleMin', 'ThrottleMax', 'nGearAvg', 'nGearMin', 'nGearMax',
+            'BrakeCount', 'DrsCount','Sector1Time', 'Sector2Time', 'Sector3Time', 'SpeedI1',
+            'SpeedI2', 'SpeedFL','SpeedST', 'SessionTime', 'LapTime']
+    # the race average uses only the laps without pit in and pit out times,
+    # but the difference is taken on every lap of the race
+    if pl is not None:
+        pl_df = pl.from_pandas(df_new[['Year', 'Location', 'PitInTime', 'PitOutTime'] + cols])
+        racing = (pl.col('PitInTime') == 0) & (pl.col('PitOutTime') == 0)
+        pl_df = pl_df.with_columns([
+            (pl.col(c) - pl.when(racing).then(pl.col(c)).mean().over(['Year', 'Location'])).alias(c)
+            for c in cols])
+        df_new[cols] = pl_df.select(cols).to_numpy()
+    else:
+        racing = (df_new['PitInTime'] == 0) & (df_new['PitOutTime'] == 0)
+        race_avg = df_new[racing].groupby(['Year', 'Location'])[cols].mean()
+        # broadcast the averages back to every lap of each race and take the difference
+        broadcast = df_new[['Year', 'Location']].merge(race_avg, left_on=['Year', 'Location'],
+                                                       right_index=True, how='left')
+        df_new[cols] = df_new[cols].to_numpy() - broadcast[cols].to_numpy()
 
     return df_new
 
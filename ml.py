@@ -1,75 +1,181 @@
 import pandas as pd
 import numpy as np
 import fastf1 as ff1
+from requests.adapters import HTTPAdapter, Retry
 import time
 import helpers
 from tqdm import tqdm
 import logging
 import os
+import shutil
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Suppress FastF1 logging messages
 logging.getLogger('fastf1').setLevel(logging.WARNING)
 
-# years
-years = [2025]
-# Race sessions
-sessions = ['R']
-
-for year in years:
-    # empty dataframe to store the all seasons and all sessions data
-    final_data = pd.DataFrame()
-
-    for s in sessions:
-        # the count of tracks in each year is not over 24
-        for track in tqdm(range(3, 5)):
-            
-            try:
-                session = ff1.get_session(year, track, s)
-            except ValueError:
-                print(f"Track {track} not available")
-                break
+logger = logging.getLogger(__name__)
 
-            # Load the data
-            session.load()
-              
-            session_results = helpers.get_session_results(session)
+# processed sessions are cached here: completed race data never changes,
+# so re-runs read the parquet file instead of downloading again
+CACHE_DIR = Path("cache")
+# bump to invalidate cached sessions whenever the pipeline output schema changes
+CACHE_VERSION = 2
 
-            session_laps = helpers.get_session_laps(session)
+# fastf1's own download cache persists between runs as well, turning its
+# ~tens-of-seconds cold session load into a few seconds
+FASTF1_CACHE_DIR = Path("fastf1_cache")
 
-            session_weather = helpers.get_weather_data(session)
 
-            session_laps = pd.merge_asof(session_laps, session_weather, on="SessionTime", direction="nearest")
+def enable_fastf1_cache():
+    """Enable fastf1's disk cache, evicting it only under real disk pressure."""
+    FASTF1_CACHE_DIR.mkdir(exist_ok=True)
+    ff1.Cache.enable_cache(str(FASTF1_CACHE_DIR))
+    if shutil.disk_usage(".").free < 2 << 30:
+        ff1.Cache.clear_cache()
 
-            session_laps_final = helpers.calculate_session_laps_final(session, session_laps)
-            
-            if session_laps_final.empty:
-                print(f"Session laps data is empty for year {year}, track {track}")
-                continue
-            
-            session_results = helpers.add_static_info(session_results)
-            # join the session laps result with driver info and final results
-            session_laps_final_with_result = pd.merge(session_laps_final, session_results, on='Driver', how='left')
+# minimum spacing between session downloads, replacing the fixed sleep after
+# every track now that several download threads run at once
+REQUEST_INTERVAL = 5.0
+_throttle_lock = threading.Lock()
+_next_request_time = 0.0
 
-            # session_laps_final_with_result = helpers.add_points(session_laps_final_with_result.copy())
 
-            print(session_laps_final_with_result.head(2))
+def throttle():
+    """Block until this thread is allowed to start the next download."""
+    global _next_request_time
+    with _throttle_lock:
+        now = time.monotonic()
+        start = max(now, _next_request_time)
+        _next_request_time = start + REQUEST_INTERVAL
+    time.sleep(max(0.0, start - now))
 
-            final_data = pd.concat([final_data, session_laps_final_with_result], ignore_index=True) if not final_data.empty else session_laps_final_with_result.copy()
-
-            print(" ----- Data loaded ---- ")
-            print(f" ----- Year: {year}, Track: {track}, Session: {session.event.Location} loaded ----")
-            ff1.Cache.clear_cache()
-            print(" ----- Cache cleared ---- ")
-            # save data
-            final_data = helpers.final_preprocessing(final_data)
-            
-            # backup export each year and track
-            final_data.to_csv(f"final_data_{year}.csv", index=False)
+# years
+years = [2025]
+# Race sessions
+sessions = ['R']
 
-            # Sleep for a while to avoid overloading the server
-            time.sleep(5)
 
-    print("\n")
-    print(f" ----- Year: {year} data loaded ----")
-    print("\n\n\n\n")
+def configure_http():
+    """Mount pooled, retrying connections on fastf1's shared HTTP sessions.
 
+    Keep-alive connection reuse avoids a TCP/TLS handshake per request across
+    the dozens of requests a session load makes, and the pool size covers the
+    concurrent download threads.
+    """
+    # retry rate-limit and transient server errors with jittered exponential
+    # backoff (honoring Retry-After) instead of sleeping unconditionally
+    retry = Retry(total=5, backoff_factor=0.5, backoff_jitter=0.5,
+                  status_forcelist=[429, 502, 503])
+    adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16, max_retries=retry)
+    # fastf1 keeps one plain and one caching requests session internally
+    for http_session in (ff1.req.Cache._requests_session, ff1.req.Cache._requests_session_cached):
+        if http_session is not None:
+            http_session.mount('https://', adapter)
+            http_session.mount('http://', adapter)
+
+
+def process(year, track, session_type, static_info=None):
+    """Load one session and calculate its final laps data.
+
+    :param int year: season year
+    :param int track: round number of the track
+    :param str session_type: session identifier, e.g. 'R' for the race
+    :param pd.DataFrame static_info: driver info table from
+        helpers.build_static_info_table, built once for all tracks
+    :return pd.DataFrame: laps data with results, or None if not available
+    """
+    cache_file = CACHE_DIR / f"{year}_{track}_{session_type}_v{CACHE_VERSION}.parquet"
+    if cache_file.exists():
+        return pd.read_parquet(cache_file)
+
+    try:
+        session = ff1.get_session(year, track, session_type)
+    except ValueError:
+        logger.info("Track %d not available", track)
+        return None
+
+    # Load the data, pacing the downloads across threads
+    throttle()
+    session.load()
+
+    session_results = helpers.get_session_results(session)
+
+    session_laps = helpers.get_session_laps(session)
+
+    session_weather = helpers.get_weather_data(session)
+
+    session_laps = helpers.merge_weather(session_laps, session_weather)
+
+    session_laps_final = helpers.calculate_session_laps_final(session, session_laps)
+
+    if session_laps_final.empty:
+        logger.info("Session laps data is empty for year %d, track %d", year, track)
+        return None
+
+    session_results = helpers.add_static_info(session_results, static_info)
+    # join the session laps result with driver info and final results; the
+    # results table is ~20 rows, so the Driver-indexed join fast path beats
+    # the general merge planner
+    session_laps_final_with_result = session_laps_final.join(session_results.set_index('Driver'), on='Driver')
+
+    # session_laps_final_with_result = helpers.add_points(session_laps_final_with_result.copy())
+
+    # repr-ing the wide frame per track is surprisingly costly and serializes
+    # the worker threads on stdout, so only log a cheap summary
+    logger.debug("Track %d: rows=%d cols=%d", track,
+                 len(session_laps_final_with_result), session_laps_final_with_result.shape[1])
+    logger.info("Year: %d, Track: %d, Session: %s loaded", year, track, session.event.Location)
+
+    # all of the preprocessing groups by race at most, so it runs here on the
+    # small per-track frame (and in parallel with the other tracks)
+    session_laps_final_with_result = helpers.per_track_preprocess(session_laps_final_with_result)
+
+    # cache the processed session for the next run
+    CACHE_DIR.mkdir(exist_ok=True)
+    session_laps_final_with_result.to_parquet(cache_file, index=False)
+
+    return session_laps_final_with_result
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    enable_fastf1_cache()
+    configure_http()
+
+    # the driver info table is track-invariant, build it once for the whole run
+    static_info = helpers.build_static_info_table()
+
+    for year in years:
+        # collect the data of all sessions, one dataframe per session
+        frames = []
+
+        for s in sessions:
+            # every (year, track) session is independent, so download and
+            # process them concurrently; threads are enough because the time
+            # is spent in network IO and in NumPy kernels, and they share
+            # fastf1's on-disk cache
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                # the count of tracks in each year is not over 24
+                futures = [executor.submit(process, year, track, s, static_info) for track in range(3, 5)]
+                for future in tqdm(as_completed(futures), total=len(futures)):
+                    session_laps_final_with_result = future.result()
+                    if session_laps_final_with_result is None:
+                        continue
+                    frames.append(session_laps_final_with_result)
+
+        if frames:
+            final_data = pd.concat(frames, ignore_index=True)
+            # save data (parquet is columnar and several times smaller than
+            # CSV; the per-session parquet files in cache/ already stream each
+            # session to disk as soon as it is processed). Write to a temp
+            # file and rename so a crash mid-write never leaves a truncated
+            # dataset behind
+            out_file = Path(f"final_data_{year}.parquet")
+            tmp_file = Path(f"final_data_{year}.parquet.tmp")
+            final_data.to_parquet(tmp_file, compression="snappy", index=False)
+            os.replace(tmp_file, out_file)
+
+        logger.info("Year: %d data loaded", year)